@@ -1,17 +1,19 @@
 import argparse
-import concurrent.futures
 import multiprocessing as mp
 import os
+import shlex
 import shutil
 import signal
 import subprocess
 import sys
 import threading
 import time
+from collections import deque
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from queue import Queue
+from string import Template
+from typing import Optional
 
 import pandas as pd
 
@@ -26,7 +28,7 @@ HTML_TEMPLATE = """
     <head>
         <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css">
         <title>Test Report</title>
-        <h1 style="text-align: center;">{{title}}</h1>
+        <h1 style="text-align: center;">${title}</h1>
         <hr>
     <style>
         body {
@@ -122,21 +124,21 @@ HTML_TEMPLATE = """
             <div style="display:grid">
                 <h3>Test Setup:</h3>
                 <ul>
-                    <li>GTest Executable : {{gtest}}</li>
-                    <li>Test Filter      : {{test_filter}}</li>
-                    <li>Working Directory: {{out_dir}}</li>
-                    <li>Total #Tests     : {{total}}</li>
+                    <li>GTest Executable : ${gtest}</li>
+                    <li>Test Filter      : ${test_filter}</li>
+                    <li>Working Directory: ${out_dir}</li>
+                    <li>Total #Tests     : ${total}</li>
                 </ul>
                 <h3>Test Summary:</h3>
-                {{summary_table}}
+                ${summary_table}
             </div>
             <div style="margin-top: 50px">
                 <h3>Failed Tests:</h3>
-                {{error_table}}
+                ${error_table}
             </div>
         </div>
     </body>
-    <footer><p>Report generated on {{datetime}}</p></footer>
+    <footer><p>Report generated on ${datetime}</p></footer>
 </html>
 """
 
@@ -154,169 +156,224 @@ class FontColor(Enum):
     DEFAULT = '\x1b[39m'
 
 
+_RESET = FontColor.RESET.value
+
+
 class SimpleLogger:
+    def __init__(self) -> None:
+        self._cols = shutil.get_terminal_size().columns
+        self._cols_ts = time.monotonic()
+
+    def _cols_now(self) -> int:
+        """Terminal width, re-queried at most once per second"""
+        now = time.monotonic()
+        if now - self._cols_ts > 1.0:
+            self._cols = shutil.get_terminal_size().columns
+            self._cols_ts = now
+        return self._cols
+
     def flush(self) -> None:
         """Flush print buffer"""
         print('', flush=True)
 
     def clear(self) -> None:
         """Clear terminal screen"""
-        print(' ' * shutil.get_terminal_size().columns, end='\r', flush=True)
+        print(' ' * self._cols_now(), end='\r', flush=True)
 
     def info(self, msg: str, fontcolor: FontColor = FontColor.DEFAULT) -> None:
         """Flush print log message"""
-        if fontcolor != FontColor.DEFAULT:
-            msg = f'{fontcolor.value}{msg}{FontColor.RESET.value}'
+        if fontcolor is not FontColor.DEFAULT:
+            msg = f'{fontcolor.value}{msg}{_RESET}'
         print(msg, flush=True)
 
     def error(self, msg: str) -> None:
         """Flush print log message with red color"""
-        print(f'{FontColor.RED.value}{msg}{FontColor.RESET.value}', flush=True)
+        print(f'{FontColor.RED.value}{msg}{_RESET}', flush=True)
 
     def warning(self, msg: str) -> None:
         """Flush print log message with yellow color"""
-        print(f'{FontColor.YELLOW.value}{msg}{FontColor.RESET.value}', flush=True)
+        print(f'{FontColor.YELLOW.value}{msg}{_RESET}', flush=True)
 
     def delay(self, msg: str, fontcolor: FontColor = FontColor.DEFAULT) -> None:
         """Allows print next message on the same line"""
-        if fontcolor != FontColor.DEFAULT:
-            msg = f'{fontcolor.value}{msg}{FontColor.RESET.value}'
+        if fontcolor is not FontColor.DEFAULT:
+            msg = f'{fontcolor.value}{msg}{_RESET}'
         print(msg, end='', flush=True)
 
     def inline(self, msg: str, fontcolor: FontColor = FontColor.DEFAULT, final: bool = False) -> None:
         """Print log message on the same line by overwriting the previous message"""
 
-        if fontcolor != FontColor.DEFAULT:
-            msg = f'{fontcolor.value}{msg}{FontColor.RESET.value}'
-        print(' ' * shutil.get_terminal_size().columns, end='\r', flush=True)
+        if fontcolor is not FontColor.DEFAULT:
+            msg = f'{fontcolor.value}{msg}{_RESET}'
+        print(' ' * self._cols_now(), end='\r', flush=True)
         print(msg, end='\r', flush=True)
         if final:
-            print(' ' * shutil.get_terminal_size().columns, end='\r', flush=True)
+            print(' ' * self._cols_now(), end='\r', flush=True)
 
     def center(self, msg: str, fontcolor: FontColor = FontColor.DEFAULT) -> None:
         """Print log message in the center of the terminal"""
-        if fontcolor != FontColor.DEFAULT:
-            msg = f'{fontcolor.value}{msg}{FontColor.RESET.value}'
-        print(msg.center(shutil.get_terminal_size().columns), flush=True)
+        if fontcolor is not FontColor.DEFAULT:
+            msg = f'{fontcolor.value}{msg}{_RESET}'
+        print(msg.center(self._cols_now()), flush=True)
 
 
-class GTestManager(SimpleLogger):
+# Scheduler, result and progress state are all shared by the worker threads under LOCK
+class GTestManager(SimpleLogger):  # pylint: disable=too-many-instance-attributes
     INTERRUPT = threading.Event()
     LOCK = threading.Lock()
+    TEST_DONE = threading.Condition(LOCK)
+    PRINT_LOCK = threading.Lock()
 
     def __init__(self, options: argparse.Namespace) -> None:
+        super().__init__()
         self.options = options
-        self.results = pd.DataFrame(columns=['Test', 'Status', 'Time', 'Log'])
+        self.results = None
         self.gtest = self._find_binary()
         self.options.output = self.options.output / f'{self.options.gtest}'  # _{datetime.now().strftime("%Y%m%d%H%M%S")}'
         self.options.output.mkdir(parents=True, exist_ok=True)
 
         # Private attributes
-        self._tests = Queue()
-        self._running_tests = Queue()
+        self._tests = {}  # group -> deque of pending tests
+        self._ready_groups = deque()  # groups with pending tests and none running
+        self._slots = None
+        self._results_rows = []
         self._total = 0
         self._finished = 0
+        self._last_progress = 0.0
+        self._drawn = 0
 
     def _find_binary(self) -> Path:
         binary = f"{self.options.gtest}.exe" if ISWINDOWS else self.options.gtest
-        paths = (self.options.root / 'builds').rglob(f'**/{binary}')
-
-        valid_paths = [path for path in paths if 'simics' not in str(path)]
-        if valid_paths:
-            return valid_paths[0]
+        for dirpath, dirs, files in os.walk(self.options.root / 'builds'):
+            dirs[:] = [d for d in dirs if 'simics' not in d]  # Skip simics builds
+            if binary in files:
+                return (Path(dirpath) / binary).resolve()
 
         self.error(f'GTest binary not found: {binary}')
         sys.exit(1)
 
-    def __execute_cmd_with_output(self, cmd: str) -> str:
+    def __execute_cmd_with_output(self, cmd: list) -> str:
         try:
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
+            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
             return output.decode('utf-8')
         except subprocess.CalledProcessError as e:
-            self.error(f'Error executing command: {cmd}')
+            self.error(f'Error executing command: {shlex.join(cmd)}')
             self.error(e.output.decode('utf-8'))
             sys.exit(1)
 
-    def __progress(self) -> None:
+    def __progress_due(self, finished: int) -> bool:
+        """Redraw at most ~30 times per second, but always show the final state. Call with LOCK held"""
+        now = time.monotonic()
+        if finished < self._total and now - self._last_progress < 0.033:
+            return False
+        self._last_progress = now
+        return True
+
+    def __progress(self, finished: int) -> None:
         if self._total == 0 or self.INTERRUPT.is_set():
             return
-        progress = int((self._finished / self._total) * 100)
+
+        progress = int((finished / self._total) * 100)
         pbar = '=' * (progress - 1) + '>' if progress > 0 else ''
-        self.delay(f'\r[{pbar}{" " * (100 - progress)}] {progress}% ({self._finished}/{self._total})')
+        with self.PRINT_LOCK:
+            # A preempted worker must not overwrite a newer count
+            if finished < self._drawn:
+                return
+            self._drawn = finished
+            self.delay(f'\r[{pbar}{" " * (100 - progress)}] {progress}% ({finished}/{self._total})')
 
     def _run_test(self, test: tuple) -> None:
         test_name, cmd, working_dir, retry = test
 
-        with self.LOCK:
-            self._running_tests.put(test_name)
-
-        working_dir.mkdir(parents=True, exist_ok=True)
-        os.chdir(working_dir)
         log = working_dir / 'run.log'
+        status = 'Failed'
         start = time.time()
-        ret = 0
-
-        with open(log, 'w') as f:
-            with subprocess.Popen(cmd, stdout=f, stderr=f, shell=True) as process:
-                if self.INTERRUPT.is_set():
-                    process.send_signal(signal.SIGINT)
-                    ret = -signal.SIGINT
-                else:
-                    ret = process.wait()
-
-        if ret != 0 and retry > 0 and not self.INTERRUPT.is_set():
-            self._run_test((test_name, cmd, working_dir, retry - 1))
-            return
 
-        run_time = int(1000 * (time.time() - start))
-        status = 'Passed' if ret == 0 else 'Killed' if ret == -signal.SIGINT else 'Failed'
+        try:
+            with open(log, 'w') as f:
+                for _ in range(max(retry, 0) + 1):
+                    start = time.time()
+                    with subprocess.Popen(cmd, stdout=f, stderr=f, cwd=working_dir) as process:
+                        if self.INTERRUPT.is_set():
+                            process.send_signal(signal.SIGINT)
+                            ret = -signal.SIGINT
+                        else:
+                            ret = process.wait()
+
+                    if ret == 0 or self.INTERRUPT.is_set():
+                        break
 
-        with self.LOCK:
-            self._running_tests.get()
+            status = 'Passed' if ret == 0 else 'Killed' if ret == -signal.SIGINT else 'Failed'
+        except OSError as e:
+            self.error(f'\nFailed to run {test_name}: {e}')
+        finally:
+            # Always free the job slot and the suite, otherwise the dispatcher waits forever
+            self._finish_test(test_name, status, int(1000 * (time.time() - start)), log)
+
+    def _finish_test(self, test_name: str, status: str, run_time: int, log: Path) -> None:
+        with self.TEST_DONE:
+            group = self._group_of(test_name)
+            if group in self._tests:
+                self._ready_groups.append(group)
             self._finished += 1
-            self.results.loc[len(self.results)] = [test_name, status, run_time, log]
-            self.__progress()
-
-    def _schedule_tests(self) -> None:
-        running_groups = []
-        test_group = None
-
-        while True:
+            finished = self._finished
+            draw = self.__progress_due(finished)
+            self._results_rows.append((test_name, status, run_time, str(log)))
+            self.TEST_DONE.notify()
+        self._slots.release()
+        if draw:
+            self.__progress(finished)
+
+    def _group_of(self, test_name: str) -> str:
+        """Tests of one group never run concurrently: the suite with --serial-suites, else the test itself"""
+        return test_name.split('.')[0] if self.options.serial_suites else test_name
+
+    def _next_test(self) -> Optional[tuple]:
+        """Wait for a free job slot and pop the next test of a group that is not running"""
+        # The slot is released by _finish_test in the worker thread
+        while not self._slots.acquire(timeout=0.1):  # pylint: disable=consider-using-with
             if self.INTERRUPT.is_set():
-                break
-
-            if self._tests.empty():
-                break
-
-            test_candidate = None
-            with self.LOCK:
-                for _ in range(self._tests.qsize()):
-                    test_candidate = self._tests.queue[0]
-                    if test_candidate[0].split('.')[0] not in running_groups:
-                        self._tests.get()
-                        break
-
-            if test_candidate is None:
-                return
-
-            test_group = test_candidate[0].split('.')[0]
-            running_groups.append(test_group)
-            self._run_test(test_candidate)
-
-            if running_groups:
-                running_groups.remove(test_group)
+                return None
+
+        with self.TEST_DONE:
+            while self._tests and not self.INTERRUPT.is_set():
+                if self._ready_groups:
+                    group = self._ready_groups.popleft()
+                    group_tests = self._tests[group]
+                    test = group_tests.popleft()
+                    if not group_tests:
+                        del self._tests[group]
+                    return test
+
+                # All pending groups are busy, wait for a running test to finish
+                self.TEST_DONE.wait(timeout=0.1)
+
+        self._slots.release()
+        return None
+
+    @staticmethod
+    def _join_workers(workers: list) -> None:
+        """Wait for worker threads while staying responsive to KeyboardInterrupt"""
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(timeout=0.1)
 
     def get_test_list(self) -> None:
-        cmd = f'"{self.gtest}" --gtest_list_tests'
+        cmd = [str(self.gtest), '--gtest_list_tests']
 
         if self.options.filter:
-            cmd += f' --gtest_filter={self.options.filter}'
+            cmd.append(f'--gtest_filter={self.options.filter}')
 
         test_list = self.__execute_cmd_with_output(cmd)
         current_group = None
 
+        gtest_path = str(self.gtest)
+        extra_opts = self.options.opts[1:]
+        out_dir = self.options.output
+        retry = self.options.retry
+
         for line in test_list.splitlines():
-            stripped_line = line.split('#')[0].strip()  # Remove comments and strip whitespace
+            stripped_line = line.partition('#')[0].strip()  # Remove comments and strip whitespace
             if not stripped_line:
                 continue
 
@@ -324,42 +381,49 @@ class GTestManager(SimpleLogger):
                 current_group = stripped_line
             else:
                 test_name = f'{current_group}{stripped_line}'
-                test_cmd = f'"{self.gtest.as_posix()}" --gtest_filter={test_name}'
-
-                if self.options.opts:
-                    test_cmd += f' {" ".join(self.options.opts[1:])}'
+                test_cmd = [gtest_path, f'--gtest_filter={test_name}', *extra_opts]
+                working_dir = out_dir / test_name
+                working_dir.mkdir(parents=True, exist_ok=True)
+                group = self._group_of(test_name)
+                if group not in self._tests:
+                    self._tests[group] = deque()
+                    self._ready_groups.append(group)
+                self._tests[group].append((test_name, test_cmd, working_dir, retry))
+                self._total += 1
 
-                working_dir = self.options.output / test_name
-                self._tests.put((test_name, test_cmd, working_dir, self.options.retry))
-
-        self._total = self._tests.qsize()
         self.options.jobs = min(self.options.jobs, self._total)
 
     def execute_tests(self) -> None:
         self.info(f'Running {self._total} tests in {self.options.jobs} jobs...', FontColor.CYAN)
-        self.__progress()
+        self.__progress(self._finished)
+
+        self._slots = threading.Semaphore(self.options.jobs)
+        workers = []
+
+        try:
+            while self._tests and not self.INTERRUPT.is_set():
+                test = self._next_test()
+                if test is None:
+                    break
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.options.jobs) as executor:
-            futures = [executor.submit(self._schedule_tests) for _ in range(self.options.jobs)]
+                worker = threading.Thread(target=self._run_test, args=(test,), daemon=True)
+                worker.start()
+                workers.append(worker)
 
-            try:
-                while not all(f.done() for f in futures):
-                    time.sleep(0.1)
-            except KeyboardInterrupt:
-                self.INTERRUPT.set()
-                self.warning('\n\nInterrupted by user...')
-                executor.shutdown(wait=False, cancel_futures=True)
+            self._join_workers(workers)
+        except KeyboardInterrupt:
+            self.INTERRUPT.set()
+            self.warning('\n\nInterrupted by user...')
+            self._join_workers(workers)
 
     def summerize(self) -> None:
-        results = self.results.copy()
-        results['Suite'] = results['Test'].apply(lambda x: (x.split('.')[0]).split('/')[0].strip())
-
-        summary = results.groupby('Suite').agg(
-            Tests=pd.NamedAgg(column='Test', aggfunc='count'),
-            Passed=pd.NamedAgg(column='Status', aggfunc=lambda x: (x == 'Passed').sum()),
-            Failed=pd.NamedAgg(column='Status', aggfunc=lambda x: (x == 'Failed').sum()),
-            Killed=pd.NamedAgg(column='Status', aggfunc=lambda x: (x == 'Killed').sum()),
-        )
+        self.results = results = pd.DataFrame(self._results_rows, columns=['Test', 'Status', 'Time', 'Log'])
+        results['Suite'] = results['Test'].str.split('.', n=1).str[0].str.split('/', n=1).str[0]
+
+        # Count statuses per suite in a single pass
+        counts = pd.crosstab(results['Suite'], results['Status'])
+        summary = counts.reindex(columns=['Passed', 'Failed', 'Killed'], fill_value=0).rename_axis(columns=None)
+        summary.insert(0, 'Tests', summary.sum(axis=1))
 
         # Add a total row
         total_row = pd.DataFrame({
@@ -384,7 +448,6 @@ class GTestManager(SimpleLogger):
         self.generate_html_report(summary.reset_index(), results)
 
     def generate_html_report(self, summary: pd.DataFrame, results: pd.DataFrame) -> None:
-        results = results.reset_index()
         status = results['Status'].unique().tolist()
 
         summary['Failed'] = summary['Failed'].apply(lambda x: f'<span style="color:red">{x}</span>' if x > 0 else x)
@@ -395,17 +458,17 @@ class GTestManager(SimpleLogger):
         if 'Failed' in status or 'Killed' in status:
             error_table = results[results['Status'] != 'Passed'][['Suite', 'Test', 'Status', 'Time', 'Log']]
             error_table['Group'] = error_table['Test'].apply(lambda x: x.split('.')[0].split('/')[1] if '/' in x else x.split('.')[0])
-            error_table = [
+            error_rows = "".join(
                 f"""\
                 <tr>
-                    <td>{row['Suite']}</td>
-                    <td>{row['Group']}</td>
-                    <td><a href="{row['Log']}">{row['Test'].split('.')[1]}</a></td>
-                    <td>{row['Status']}</td>
-                    <td>{row['Time']}</td>
+                    <td>{row.Suite}</td>
+                    <td>{row.Group}</td>
+                    <td><a href="{row.Log}">{row.Test.split('.')[1]}</a></td>
+                    <td>{row.Status}</td>
+                    <td>{row.Time}</td>
                 </tr>"""
-                for _, row in error_table.iterrows()
-            ]
+                for row in error_table.itertuples(index=False)
+            )
 
             error_table = f"""\
                 <table class="err">
@@ -419,17 +482,20 @@ class GTestManager(SimpleLogger):
                         </tr>
                     </thead>
                     <tbody>
-                        {"".join(error_table)}
+                        {error_rows}
                     </tbody>
                 </table>"""
 
-        html_report = HTML_TEMPLATE.replace('{{title}}', f'{self.options.gtest} Report')
-        html_report = html_report.replace('{{gtest}}', self.gtest.as_posix())
-        html_report = html_report.replace('{{test_filter}}', self.options.filter)
-        html_report = html_report.replace('{{out_dir}}', self.options.output.as_posix())
-        html_report = html_report.replace('{{total}}', str(self._total))
-        html_report = html_report.replace('{{error_table}}', error_table)
-        html_report = html_report.replace('{{summary_table}}', summary_table)
+        html_report = Template(HTML_TEMPLATE).substitute(
+            title=f'{self.options.gtest} Report',
+            gtest=self.gtest.as_posix(),
+            test_filter=self.options.filter,
+            out_dir=self.options.output.as_posix(),
+            total=self._total,
+            summary_table=summary_table,
+            error_table=error_table,
+            datetime=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
         with open(self.options.output / 'report.html', 'w') as f:
             f.write(html_report)
 
@@ -463,6 +529,7 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--filter', type=str, default='*', help='Test filter. ex: "*Test*opt*"')
     parser.add_argument('-j', '--jobs', type=int, default=mp.cpu_count(), help='Number of jobs')
     parser.add_argument('-R', '--retry', type=int, default=2, help='Number of retry attempts')
+    parser.add_argument('-s', '--serial-suites', action='store_true', help='Run tests of the same suite one at a time')
     parser.add_argument('-t', '--timeout', type=int, default=60, help='Timeout in seconds')
     parser.add_argument('-o', '--output', type=Path, default=Path().cwd(), help='Output directory')
     parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra options. \
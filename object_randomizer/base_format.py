@@ -7,14 +7,21 @@ from rand_object import RandObject
 
 sys.dont_write_bytecode = True
 
+# generated encode functions, shared by every format with the same layout
+_ENCODERS = {}
+
 
 class BaseFormat(RandObject):
 
     def __init__(self, fmt, fmt_width, instr, seed=None):
         super().__init__(fmt, seed)
         self._bitwidth = fmt_width
+        self._format_mask = (1 << fmt_width) - 1
         self._instr = instr
         self._fields = {}
+        self._nonvirtual_fields = []
+        self._virtual_fields = []
+        self._encode_fn = None
 
     def __str__(self):
         return f"{self._instr}_{super().__str__()}"
@@ -30,12 +37,42 @@ class BaseFormat(RandObject):
             if fobj.ftype != FieldType.IMPLIED:
                 self.addVariable(fobj.name, fobj.domain)
 
+        # split fields once, print and the generated encode reuse them
+        self._nonvirtual_fields = [f for f in self._fields.values() if f.ftype != FieldType.VIRTUAL]
+        self._virtual_fields = [f for f in self._fields.values() if f.ftype == FieldType.VIRTUAL]
+        self._encode_fn = None
+
+    def _compile_encode(self):
+        # the field layout is fixed now, so generate a straight-line encode for it
+        def term(f):
+            return f"((f[{f.name!r}]._value & {f.mask:#x}) << {f.start})"
+
+        lines = [
+            "def _encode(f):",
+            f"    value = {' | '.join(term(f) for f in self._nonvirtual_fields) or '0'}",
+        ]
+        for f in self._virtual_fields:
+            lines += [
+                f"    if f[{f.cfield!r}]._value == {f.cvalue!r}:",
+                f"        value = (value & ~{f.mask << f.start:#x}) | {term(f)}",
+            ]
+        lines.append(f"    return value & {self._format_mask:#x}")
+
+        source = "\n".join(lines)
+        if source not in _ENCODERS:
+            namespace = {}
+            exec(source, namespace)  # pylint: disable=exec-used
+            _ENCODERS[source] = namespace['_encode']
+        return _ENCODERS[source]
+
+    def __getstate__(self):
+        # generated functions can't be pickled, encode rebuilds it on first use
+        state = self.__dict__.copy()
+        state['_encode_fn'] = None
+        return state
+
     def print(self):
-        data = {}
-        for field in self._fields.items():
-            if getattr(field[1], 'ftype', None) == FieldType.VIRTUAL:
-                continue
-            data[field[0]] = field[1].value
+        data = {field.name: field.value for field in self._nonvirtual_fields}
         # dataframe from dictionary
         df = pd.DataFrame(data, index=[0]).T.rename(columns={0: 'Value'})
         print(df.to_markdown() + '\n')
@@ -57,30 +94,14 @@ class BaseFormat(RandObject):
         self._randomize(**kwargs)
 
     def encode(self) -> int:
-        value = 0
-
-        # iterate over fields and set the final value
-        for field in self._fields.values():
-            if field.ftype == FieldType.VIRTUAL:
-                continue
-            value |= field.get_pos_value(self._bitwidth)
-
-        # iterate over virtual fields and resolve the value
-        for field in self._fields.values():
-            if field.ftype == FieldType.VIRTUAL:
-                cfield = self._fields[field.cfield]
-                if cfield.value == field.cvalue:
-                    # clear the bits
-                    value &= ~(field.mask << field.start)
-                    # set the bits
-                    value |= field.get_pos_value(self._bitwidth)
-
-        return value
+        if self._encode_fn is None:
+            self._encode_fn = self._compile_encode()
+        return self._encode_fn(self._fields)
 
     @property
     def hex(self) -> str:
-        return hex(self.encode())[2:].zfill(self._bitwidth // 4)
+        return f'{self.encode():0{self._bitwidth // 4}x}'
 
     @property
     def bytes(self) -> bytes:
-        return bytes.fromhex(self.hex)[::-1]
+        return self.encode().to_bytes((self._bitwidth + 7) // 8, 'little')
@@ -3,6 +3,7 @@ from enum import Enum
 from typing import Any
 
 import random
+import numpy as np
 from pydantic import BaseModel, PrivateAttr
 
 sys.dont_write_bytecode = True
@@ -30,6 +31,7 @@ class Field(BaseModel):
     _mask: int = PrivateAttr()
     _value: int = PrivateAttr()
     _rand_mode: bool = PrivateAttr(default=True)
+    _domain_cache: list = PrivateAttr(default=None)
 
     def __init__(self, **data: Any):
         if 'ftype' in data:
@@ -71,13 +73,22 @@ class Field(BaseModel):
                 return self.values
 
             if self.size > 16:
-                sample = [random.randint(0, (1 << self.size) - 1) for _ in range(1000)]
-                return sample
+                if self._domain_cache is None:
+                    self._domain_cache = self._sample_domain()
+                return self._domain_cache
             return range(1 << self.size)
         return [self.default]
 
+    def _sample_domain(self, samples: int = 1000) -> list:
+        # Seed from the global generator so random.seed() keeps runs reproducible
+        if self.size > 64:
+            return [random.randint(0, self.mask) for _ in range(samples)]
+        rng = np.random.default_rng(random.getrandbits(64))
+        return rng.integers(0, self.mask, size=samples, dtype=np.uint64, endpoint=True).tolist()
+
     def set_rand_mode(self, mode: bool) -> None:
         self._rand_mode = mode
+        self._domain_cache = None
 
     def set_value(self, value: int) -> None:
         self._value = value
@@ -87,6 +98,7 @@ class Field(BaseModel):
             self.values = list(domain)
         else:
             self.values = domain
+        self._domain_cache = None
 
     def get_pos_value(self, format_bits: int):
         format_mask = (1 << format_bits) - 1
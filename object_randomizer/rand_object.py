@@ -3,6 +3,7 @@ import random
 import sys
 from datetime import datetime
 
+import numpy as np
 from constraint import Problem
 
 sys.dont_write_bytecode = True
@@ -36,13 +37,15 @@ class RandObject(Problem):
     def _randomize(self, **kwargs):
         self._pre_randomize(**kwargs)
 
-        rand = self._install_seed()
+        rng = np.random.default_rng(self._install_seed().getrandbits(64))
         domains, constraints, vconstraints = self._getArgs()
         if domains is None:
             raise ValueError("No domains specified")
 
-        for var in domains:
-            rand.shuffle(domains[var])
+        # permute in place, the solver expects its own Domain objects
+        for domain in domains.values():
+            order = rng.permutation(len(domain))
+            domain[:] = [domain[i] for i in order]
         self._solution = self._solver.getSolution(domains, constraints, vconstraints)
 
         if self._solution is None:
@@ -1,25 +1,13 @@
 import sys
 from enum import Enum
+from types import SimpleNamespace
 
 sys.dont_write_bytecode = True
 
 
 def constants_factory(offset, num_consts, prefix="CONST"):
-    class Constants:
-        __slots__ = tuple(f"{prefix}{i}" for i in range(num_consts))
-
-        def __init__(self):
-            for i in range(num_consts):
-                setattr(self, f"{prefix}{i}", i + offset)
-
-        def __str__(self) -> str:
-            return f"r{self}"
-
-        @property
-        def size(self) -> int:
-            return num_consts
-
-    return Constants()
+    consts = {f"{prefix}{i}": offset + i for i in range(num_consts)}
+    return SimpleNamespace(**consts, size=num_consts)
 
 
 GRF = constants_factory(32, 256, 'r')